@@ -0,0 +1,262 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from dataclasses import dataclass
+from dotenv import load_dotenv
+import asyncio
+import atexit
+import functools
+import hashlib
+import json
+import os
+import shelve
+import sys
+import textwrap
+import threading
+
+# The heavy LangChain imports are deferred until an LLM is actually built,
+# so the API key and input checks in the scripts stay fast
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+# Load environment variables from a .env file if present
+load_dotenv()
+
+# Exact-match response cache, enabled by pointing LLM_CACHE_PATH at a file (useful while iterating on prompts)
+_CACHE_PATH = os.getenv("LLM_CACHE_PATH")
+_CACHE_LOCK = threading.Lock()
+
+# Set CREW_VERBOSE=1 to log what the agents are doing to stderr
+VERBOSE = os.getenv("CREW_VERBOSE", "0") == "1"
+
+# Flush every streamed token only when a terminal is watching; piped output is flushed at task boundaries
+_LIVE_FLUSH = sys.stdout.isatty()
+
+# Prose tasks are asked to finish with this marker, which is also a stop sequence
+END_MARKER = "--- END ---"
+
+# Free model raced against any request that has not started answering within HEDGE_AFTER seconds
+FALLBACK_MODEL = os.getenv("OPENROUTER_FALLBACK_MODEL", "mistralai/mistral-7b-instruct:free")
+HEDGE_AFTER = 15.0
+
+# Shortest input worth running the full chain of LLM calls on
+MIN_INPUT_LENGTH = 10
+
+@dataclass(frozen=True)
+class Agent:
+    """A persona and the LLM that speaks for it.
+
+    The driver calls the LangChain LLM directly; crewai.Agent would replace it with its own LLM wrapper.
+    """
+    role: str
+    goal: str
+    backstory: str
+    llm: ChatOpenAI
+
+@dataclass(frozen=True)
+class Task:
+    """A prompt for an agent, together with the output it is expected to produce."""
+    description: str
+    agent: Agent
+    expected_output: str
+
+def set_llm_env(api_key: str) -> None:
+    """Set environment variables for LLM API key."""
+    os.environ["OPENROUTER_API_KEY"] = api_key
+
+def get_api_key() -> str:
+    """Retrieve the API key from environment variables."""
+    return os.getenv('OPENROUTER_API_KEY')
+
+@functools.lru_cache(maxsize=None)
+def get_http_clients() -> tuple:
+    """Return the shared sync and async connection pools, so every agent reuses the same keep-alive connections to OpenRouter."""
+    import httpx
+    limits = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60.0)
+    client = httpx.Client(limits=limits)
+    atexit.register(client.close)
+    return client, httpx.AsyncClient(limits=limits)
+
+@functools.lru_cache(maxsize=8)
+def create_openrouter_llm(model_name: str, max_tokens: int, json_mode: bool = False) -> ChatOpenAI:
+    """Create and return a ChatOpenAI instance configured for OpenRouter, reusing one per model.
+
+    With json_mode the model is constrained to reply with a single JSON object.
+    """
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise ValueError("OpenRouter API key not found in environment variables.")
+    from langchain_openai import ChatOpenAI
+    http_client, http_async_client = get_http_clients()
+    return ChatOpenAI(
+        model_name=model_name,
+        openai_api_key=api_key,
+        openai_api_base="https://openrouter.ai/api/v1",
+        streaming=True,
+        max_tokens=max_tokens,
+        temperature=0.7,
+        request_timeout=120,
+        max_retries=2,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        model_kwargs={"response_format": {"type": "json_object"}} if json_mode else {}
+    )
+
+def is_json_mode(llm) -> bool:
+    """Check whether the LLM is constrained to JSON output, in which case no END_MARKER is used."""
+    return "response_format" in llm.model_kwargs
+
+def stop_sequences(llm) -> list | None:
+    """Return the stop sequences for the LLM: END_MARKER for prose, none for JSON mode."""
+    return None if is_json_mode(llm) else [END_MARKER]
+
+def is_meaningful_input(text: str) -> bool:
+    """Check that the user's input is long enough to be worth sending to the LLMs."""
+    return len(text) >= MIN_INPUT_LENGTH and any(c.isalpha() for c in text)
+
+async def prewarm_connection() -> None:
+    """Open a keep-alive connection to OpenRouter ahead of the first LLM call."""
+    import httpx
+    try:
+        await get_http_clients()[1].head("https://openrouter.ai/api/v1/models")
+    except httpx.HTTPError:
+        pass
+
+async def close_http_client() -> None:
+    """Close the shared async connection pool on the event loop that used it."""
+    await get_http_clients()[1].aclose()
+
+async def read_input(prompt: str) -> str:
+    """Read a line from stdin without blocking the event loop.
+
+    input() runs on a daemon thread rather than in the default executor, so Ctrl-C at the prompt exits at once
+    instead of waiting in asyncio.run's executor shutdown for the blocked read to return.
+    """
+    loop = asyncio.get_running_loop()
+    line = loop.create_future()
+
+    def resolve(setter, value) -> None:
+        if not line.done():
+            setter(value)
+
+    def read() -> None:
+        try:
+            text = input(prompt)
+        except Exception as e:
+            loop.call_soon_threadsafe(resolve, line.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(resolve, line.set_result, text)
+
+    threading.Thread(target=read, daemon=True).start()
+    return await line
+
+def build_messages(task: Task, context: str = "") -> list:
+    """Build the chat messages for a task from its agent's persona and the task description."""
+    from langchain_core.messages import HumanMessage, SystemMessage
+    agent = task.agent
+    system = f"You are the {agent.role}. {textwrap.dedent(agent.backstory).strip()}\nYour goal: {agent.goal}"
+    prompt = f"{textwrap.dedent(task.description).strip()}\n\nExpected output: {task.expected_output}"
+    if context:
+        prompt = f"{prompt}\n\n{context}"
+    if not is_json_mode(agent.llm):
+        prompt = f"{prompt}\n\nWhen you are finished, write {END_MARKER} on its own line."
+    return [SystemMessage(content=system), HumanMessage(content=prompt)]
+
+def cache_key(llm, messages: list) -> str:
+    """Hash the model name, the generation settings and the full prompt into a response cache key."""
+    settings = [llm.max_tokens, stop_sequences(llm), is_json_mode(llm)]
+    payload = json.dumps([llm.model_name, settings, [[message.type, message.content] for message in messages]])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def read_cache(key: str):
+    """Return the cached response for a key, or None on a miss."""
+    with _CACHE_LOCK, shelve.open(_CACHE_PATH) as cache:
+        return cache.get(key)
+
+def write_cache(key: str, response: str) -> None:
+    """Store a response in the cache."""
+    with _CACHE_LOCK, shelve.open(_CACHE_PATH) as cache:
+        cache[key] = response
+
+def start_stream(llm, messages: list):
+    """Start streaming the LLM's reply, stopping at END_MARKER for prose tasks."""
+    return llm.astream(messages, stop=stop_sequences(llm))
+
+async def open_stream(llm, messages: list) -> tuple:
+    """Start streaming from the LLM, hedging with the fallback model if no chunk arrives within HEDGE_AFTER seconds.
+
+    Returns the LLM that answered first, its stream and its first chunk (None for an empty reply); the other is cancelled.
+    """
+    primary = start_stream(llm, messages)
+    first = asyncio.ensure_future(anext(primary, None))
+    done, _ = await asyncio.wait({first}, timeout=HEDGE_AFTER)
+    if done or llm.model_name == FALLBACK_MODEL:
+        return llm, primary, await first
+    log(f"[{llm.model_name}] no response after {HEDGE_AFTER:.0f}s, racing {FALLBACK_MODEL}")
+    fallback_llm = create_openrouter_llm(FALLBACK_MODEL, llm.max_tokens, is_json_mode(llm))
+    fallback = start_stream(fallback_llm, messages)
+    attempts = {first: (llm, primary), asyncio.ensure_future(anext(fallback, None)): (fallback_llm, fallback)}
+    while True:
+        done, _ = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+        for attempt in done:
+            winner, stream = attempts.pop(attempt)
+            if attempt.exception() is None or not attempts:
+                for loser in attempts:
+                    loser.cancel()
+                return winner, stream, attempt.result()
+
+async def stream_llm(llm, messages: list, accept=None):
+    """Yield the text of each chunk streamed back by the LLM, replaying cached responses for repeated prompts.
+
+    Empty replies are never cached, nor are replies the optional accept(reply) check rejects.
+    """
+    key = cache_key(llm, messages)
+    if _CACHE_PATH:
+        # Disk I/O runs in a worker thread so it never stalls the other streams sharing the event loop
+        cached = await asyncio.to_thread(read_cache, key)
+        if cached is not None:
+            log(f"[{llm.model_name}] cache hit")
+            yield cached
+            return
+    winner, stream, chunk = await open_stream(llm, messages)
+    chunks = []
+    while chunk is not None:
+        chunks.append(chunk.content)
+        yield chunk.content
+        chunk = await anext(stream, None)
+    reply = "".join(chunks)
+    if _CACHE_PATH and reply.strip() and (accept is None or accept(reply)):
+        # A hedged reply is stored under the model that actually wrote it, never under the primary's key
+        if winner is not llm:
+            key = cache_key(winner, messages)
+        await asyncio.to_thread(write_cache, key, reply)
+
+def print_section(title: str) -> None:
+    """Print the header that introduces a task's output."""
+    print(f"\n\n--- {title} ---\n", flush=True)
+
+def print_live(text: str) -> None:
+    """Write streamed text to stdout as soon as it arrives."""
+    sys.stdout.write(text)
+    if _LIVE_FLUSH:
+        sys.stdout.flush()
+
+def log(message: str) -> None:
+    """Log progress to stderr when CREW_VERBOSE is enabled."""
+    if VERBOSE:
+        print(message, file=sys.stderr, flush=True)
+
+async def run_task(task: Task, context: str = "", live: bool = False, accept=None) -> str:
+    """Run a task on its agent's LLM and return the full output, optionally echoing it as it streams.
+
+    accept is passed on to stream_llm to decide whether the output may be cached.
+    """
+    log(f"[{task.agent.role}] started")
+    chunks = []
+    async for text in stream_llm(task.agent.llm, build_messages(task, context), accept):
+        chunks.append(text)
+        if live:
+            print_live(text)
+    if live:
+        sys.stdout.flush()
+    log(f"[{task.agent.role}] finished")
+    return "".join(chunks)
@@ -1,36 +1,21 @@
-from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage
-from crewai import Agent, Task, Crew, Process
-from dotenv import load_dotenv
-import os
-
-# Load environment variables from a .env file if present
-load_dotenv()
-
-def set_llm_env(api_key: str) -> None:
-    """Set environment variables for LLM API key."""
-    os.environ["OPENROUTER_API_KEY"] = api_key
-
-def get_api_key() -> str:
-    """Retrieve the API key from environment variables."""
-    return os.getenv('OPENROUTER_API_KEY')
-
-def get_task_result(task_output) -> str:
-    """Extract the raw output from a task."""
-    return task_output.raw_output
-
-def create_openrouter_llm(model_name: str) -> ChatOpenAI:
-    """Create and return a ChatOpenAI instance configured for OpenRouter."""
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        raise ValueError("OpenRouter API key not found in environment variables.")
-    return ChatOpenAI(
-        model_name=model_name,
-        openai_api_key=api_key,
-        openai_api_base="https://openrouter.ai/api/v1"
-    )
-
-def main():
+from types import MappingProxyType
+import asyncio
+import sys
+from openrouter_agents import (
+    MIN_INPUT_LENGTH, Agent, Task, build_messages, close_http_client, create_openrouter_llm, get_api_key, is_meaningful_input,
+    log, prewarm_connection, print_live, print_section, read_input, run_task, set_llm_env, stream_llm
+)
+
+# Output caps that bound the worst-case latency and cost of each call
+STORY_MAX_TOKENS = 1500
+CRITIC_MAX_TOKENS = 800
+
+# The critic reviews the story as it streams, but only once enough new prose has arrived,
+# and in a bounded number of passes
+CRITIQUE_MIN_BATCH_CHARS = 1200
+MAX_CRITIQUE_PASSES = 3
+
+async def main():
     api_key = get_api_key()
 
     if api_key is None:
@@ -40,53 +25,55 @@ def main():
     set_llm_env(api_key)
     print("Environment variables set successfully.")
 
-    print("## Welcome to the story generator.")
-    scenario_input = input("Describe a scenario: ")
+    # Warm up the connection while the user is typing the scenario
+    prewarm = asyncio.create_task(prewarm_connection())
 
     try:
+        print("## Welcome to the story generator.")
+        scenario_input = (await read_input("Describe a scenario: ")).strip()
+        if not is_meaningful_input(scenario_input):
+            print(f"Scenario too short: please describe it in words, at least {MIN_INPUT_LENGTH} characters long.")
+            return
+
         story_model = "gryphe/mythomist-7b:free"
         critic_model = "nousresearch/nous-capybara-7b:free"
 
-        story_agent = create_agent("Storyteller", "Create a compelling story based on the described scenario, embracing artistic freedom.", story_model)
-        critic_agent = create_agent("Literary Critic", "Provide insightful and detailed feedback to enhance the quality of the story.", critic_model)
+        story_agent = create_agent("Storyteller", "Create a compelling story based on the described scenario, embracing artistic freedom.", story_model, STORY_MAX_TOKENS)
+        critic_agent = create_agent("Literary Critic", "Provide insightful and detailed feedback to enhance the quality of the story.", critic_model, CRITIC_MAX_TOKENS)
 
         tasks = create_tasks(scenario_input, story_agent, critic_agent)
-        crew = Crew(
-            agents=[story_agent, critic_agent],
-            tasks=tasks,
-            process=Process.sequential,
-            verbose=True
-        )
-
-        result = crew.kickoff()
-        print("Process completed.")
-        handle_result(result)
+        await run_pipeline(tasks)
+        print("\n\nProcess completed.")
 
     except Exception as e:
         print(f"An error occurred: {str(e)}")
-
-def create_agent(role: str, goal: str, model_name: str) -> Agent:
+    finally:
+        # The warm-up is never awaited, so a slow HEAD cannot delay the first LLM call
+        prewarm.cancel()
+        await close_http_client()
+
+_BACKSTORIES = MappingProxyType({
+    "Storyteller": """
+        You are a versatile and imaginative agent committed to artistic freedom and creativity.
+        Your goal is to fully immerse in the scenario provided by the user, crafting a narrative that aligns with the given themes.
+        Your stories are characterized by their originality, emotional depth, and adherence to the core elements of the user-defined scenario.
+        You draw inspiration from a broad spectrum of literature and storytelling traditions, ensuring that each story is unique and true to its intended genre.
+    """,
+    "Literary Critic": """
+        The critic agent, named "Aurelius," embodies the analytical prowess of history's greatest literary critics and scholars.
+        Aurelius has spent its development in virtual literary salons, absorbing insights from classical and contemporary critiques.
+        It evaluates narrative structure, character development, dialogue, style, coherence, and analytical rigor.
+        Aurelius' mission is to guide writers on their creative journeys, helping them polish their narratives to shine with clarity, depth, and artistic merit.
+    """
+})
+
+def create_agent(role: str, goal: str, model_name: str, max_tokens: int) -> Agent:
     """Create and return an agent with the specified role, goal, and LLM model."""
-    backstories = {
-        "Storyteller": """
-            You are a versatile and imaginative agent committed to artistic freedom and creativity.
-            Your goal is to fully immerse in the scenario provided by the user, crafting a narrative that aligns with the given themes.
-            Your stories are characterized by their originality, emotional depth, and adherence to the core elements of the user-defined scenario.
-            You draw inspiration from a broad spectrum of literature and storytelling traditions, ensuring that each story is unique and true to its intended genre.
-        """,
-        "Literary Critic": """
-            The critic agent, named "Aurelius," embodies the analytical prowess of history's greatest literary critics and scholars.
-            Aurelius has spent its development in virtual literary salons, absorbing insights from classical and contemporary critiques.
-            It evaluates narrative structure, character development, dialogue, style, coherence, and analytical rigor.
-            Aurelius' mission is to guide writers on their creative journeys, helping them polish their narratives to shine with clarity, depth, and artistic merit.
-        """
-    }
-    llm = create_openrouter_llm(model_name)
     return Agent(
         role=role,
         goal=goal,
-        backstory=backstories[role],
-        llm=llm
+        backstory=_BACKSTORIES[role],
+        llm=create_openrouter_llm(model_name, max_tokens)
     )
 
 def create_tasks(scenario_input: str, story_agent: Agent, critic_agent: Agent) -> list:
@@ -97,6 +84,20 @@ def create_tasks(scenario_input: str, story_agent: Agent, critic_agent: Agent) -
         expected_output="A well-crafted story that aligns with the given scenario."
     )
 
+    scenario_task = Task(
+        description=f"""
+            Before the story is written, review the following scenario: {scenario_input}
+            Point out the pitfalls a story based on it should avoid and what it must get right in:
+            - Narrative structure
+            - Character development
+            - Dialogue
+            - Style
+            - Coherence
+        """,
+        agent=critic_agent,
+        expected_output="Concise, actionable guidance for writing and revising a story based on the scenario."
+    )
+
     task2 = Task(
         description="""
             Review the story and provide detailed feedback on the following elements:
@@ -119,23 +120,73 @@ def create_tasks(scenario_input: str, story_agent: Agent, critic_agent: Agent) -
         expected_output="A revised version of the story that addresses all critical comments from the critique."
     )
 
-    return [task1, task2, task3]
-
-def handle_result(result):
-    """Handle the result from the Crew kickoff process."""
-    try:
-        if hasattr(result, 'tasks'):
-            print("Story Output:")
-            print(get_task_result(result.tasks[0].output))
-            print("Critique Output:")
-            print(get_task_result(result.tasks[1].output))
-            print("Revised Story Output:")
-            print(get_task_result(result.tasks[2].output))
-        else:
-            print("Unexpected result format:")
-            print(result)
-    except Exception as e:
-        print(f"An error occurred while handling the result: {str(e)}")
+    return [task1, scenario_task, task2, task3]
+
+async def write_story(task: Task, paragraphs: asyncio.Queue) -> str:
+    """Stream the story, handing each finished paragraph to the critic as soon as it is complete."""
+    log(f"[{task.agent.role}] started")
+    story = ""
+    buffer = ""
+    async for text in stream_llm(task.agent.llm, build_messages(task)):
+        print_live(text)
+        story += text
+        buffer += text
+        while "\n\n" in buffer:
+            paragraph, buffer = buffer.split("\n\n", 1)
+            if paragraph.strip():
+                await paragraphs.put(paragraph)
+    sys.stdout.flush()
+    if buffer.strip():
+        await paragraphs.put(buffer)
+    await paragraphs.put(None)
+    log(f"[{task.agent.role}] finished")
+    return story
+
+async def critique_story(task: Task, paragraphs: asyncio.Queue) -> str:
+    """Review the story while it is being written, in batches of at least CRITIQUE_MIN_BATCH_CHARS of new prose.
+
+    At most MAX_CRITIQUE_PASSES critic calls are made; the final pass covers everything left once the story is complete.
+    Batches depend only on the story text, not on how fast it streams, so a cached story replays into cached critiques.
+    """
+    story_so_far = []
+    critique = []
+    batch = []
+
+    async def review_batch() -> None:
+        log(f"[{task.agent.role}] reviewing {len(batch)} new paragraph(s)")
+        context = "Story so far:\n\n" + "\n\n".join(story_so_far)
+        context += "\n\nReview only these new paragraphs:\n\n" + "\n\n".join(batch)
+        critique.append(await run_task(task, context))
+        story_so_far.extend(batch)
+        batch.clear()
+
+    while (paragraph := await paragraphs.get()) is not None:
+        batch.append(paragraph)
+        if len(critique) < MAX_CRITIQUE_PASSES - 1 and sum(map(len, batch)) >= CRITIQUE_MIN_BATCH_CHARS:
+            await review_batch()
+    if batch:
+        await review_batch()
+    return "\n\n".join(critique)
+
+async def run_pipeline(tasks: list) -> list:
+    """Run the story and both critiques concurrently; only the revision waits for all of them.
+
+    The story and the revision are streamed to stdout; the critique is printed once it is complete.
+    """
+    story_task, scenario_task, critic_task, revision_task = tasks
+    paragraphs = asyncio.Queue()
+    print_section("Story")
+    story, guidance, critique = await asyncio.gather(
+        write_story(story_task, paragraphs),
+        run_task(scenario_task),
+        critique_story(critic_task, paragraphs)
+    )
+    critique = f"{guidance}\n\n{critique}"
+    print_section("Critique")
+    print(critique)
+    print_section("Revised Story")
+    revision = await run_task(revision_task, f"Original story:\n\n{story}\n\nCritique:\n\n{critique}", live=True)
+    return [story, critique, revision]
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,112 +1,145 @@
+import asyncio
 import datetime
-import os
 import json
-from langchain_openai import ChatOpenAI
-from crewai import Agent, Task, Crew, Process
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-def set_llm_env(api_key: str) -> None:
-    """Set environment variables for LLM API key."""
-    os.environ["OPENROUTER_API_KEY"] = api_key
-
-def get_api_key() -> str:
-    """Retrieve the API key from environment variables."""
-    return os.getenv('OPENROUTER_API_KEY')
-
-def get_task_result(task_output):
-    """Extract the raw output from a task, handling both string and object outputs."""
-    if isinstance(task_output, str):
-        return task_output
-    elif hasattr(task_output, 'raw_output'):
-        return task_output.raw_output
-    else:
-        return str(task_output)  # Fall back to string representation if neither condition is met
-
-def create_openrouter_llm(model_name: str) -> ChatOpenAI:
-    """Create and return a ChatOpenAI instance configured for OpenRouter."""
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        raise ValueError("OpenRouter API key not found in environment variables.")
-    return ChatOpenAI(
-        model_name=model_name,
-        openai_api_key=api_key,
-        openai_api_base="https://openrouter.ai/api/v1"
-    )
-
-def create_agent(role: str, goal: str, model_name: str) -> Agent:
+import os
+import sys
+from types import MappingProxyType
+from pydantic import BaseModel, Field, ValidationError
+from openrouter_agents import (
+    MIN_INPUT_LENGTH, Agent, Task, close_http_client, create_openrouter_llm, get_api_key, is_meaningful_input, prewarm_connection,
+    print_section, read_input, run_task, set_llm_env
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Output caps that bound the worst-case latency and cost of each call
+CARD_MAX_TOKENS = 1500
+CRITIC_MAX_TOKENS = 800
+
+# Timestamp format used for the card's chat name and creation date
+_TIMESTAMP_FORMAT = "%Y-%m-%d @%Hh %Mm %Ss %fms"
+
+# Set CARD_LEGACY_FIELDS=0 to write a spec-v2-only card, without the v1 fields that TavernAI itself reads
+CARD_LEGACY_FIELDS = os.getenv("CARD_LEGACY_FIELDS", "1") == "1"
+
+# Top-level fields read by v1 (TavernAI) readers, mirrored from the v2 data block
+_FLAT_KEYS = ("name", "description", "personality", "scenario", "first_mes", "mes_example", "tags")
+
+_BACKSTORIES = MappingProxyType({
+    "Card Creator": """
+        You are an expert in creating rich, detailed character profiles for role-playing games and interactive fiction.
+        You understand the importance of using placeholders for dynamic character interactions.
+    """,
+    "Personality Critic": """
+        You are a master of character development, skilled at identifying and enhancing personality traits to create compelling characters.
+    """,
+    "Scenario Critic": """
+        You are an experienced storyteller, adept at crafting intriguing scenarios that bring characters to life.
+    """,
+    "Message Critic": """
+        You are a dialogue expert, skilled at crafting authentic and captivating character speech with proper formatting and placeholder usage.
+    """
+})
+
+def create_agent(role: str, goal: str, model_name: str, max_tokens: int, json_mode: bool = False) -> Agent:
     """Create and return an agent with the specified role, goal, and LLM model."""
-    backstories = {
-        "Card Creator": """
-            You are an expert in creating rich, detailed character profiles for role-playing games and interactive fiction.
-            You understand the importance of using placeholders for dynamic character interactions.
-        """,
-        "Personality Critic": """
-            You are a master of character development, skilled at identifying and enhancing personality traits to create compelling characters.
-        """,
-        "Scenario Critic": """
-            You are an experienced storyteller, adept at crafting intriguing scenarios that bring characters to life.
-        """,
-        "Message Critic": """
-            You are a dialogue expert, skilled at crafting authentic and captivating character speech with proper formatting and placeholder usage.
-        """
-    }
-    llm = create_openrouter_llm(model_name)
     return Agent(
         role=role,
         goal=goal,
-        backstory=backstories[role],
-        llm=llm
+        backstory=_BACKSTORIES[role],
+        llm=create_openrouter_llm(model_name, max_tokens, json_mode)
     )
 
+class CharacterCard(BaseModel):
+    """Character card fields produced by the card creator."""
+    name: str = "Unnamed Character"
+    description: str = ""
+    personality: str = ""
+    scenario: str = ""
+    first_message: str = ""
+    example_message: str = ""
+    creator_comment: str = ""
+    talkativeness: float = 0.5
+    fav: bool = False
+    tags: list[str] = Field(default_factory=list)
+
+def is_valid_card(reply: str) -> bool:
+    """Check that the card creator's reply is a valid card, so only valid cards are cached."""
+    try:
+        CharacterCard.model_validate_json(reply)
+    except ValidationError:
+        return False
+    return True
+
+async def run_critic(task: Task, card: CharacterCard) -> str:
+    """Run a critic on the validated card and print its feedback once complete."""
+    critique = await run_task(task, f"Character card:\n\n{card.model_dump_json(indent=2)}")
+    print_section(task.agent.role)
+    print(critique, flush=True)
+    return critique
+
+async def run_pipeline(tasks: list) -> list:
+    """Create the character card, streaming it to stdout, then have all critics review it concurrently.
+
+    Returns the validated card followed by the critiques. Raises ValidationError before any critic runs
+    if the card creator's reply is not a valid card.
+    """
+    card_task, *critic_tasks = tasks
+    print_section(card_task.agent.role)
+    card = CharacterCard.model_validate_json(await run_task(card_task, live=True, accept=is_valid_card))
+    critiques = await asyncio.gather(*(run_critic(task, card) for task in critic_tasks))
+    return [card, *critiques]
+
 # Function to create character card JSON
-def create_character_card(name, description, personality, scenario, first_mes, mes_example, creatorcomment, chat, talkativeness, fav, tags, create_date):
-    return {
+def create_character_card(name, description, personality, scenario, first_mes, mes_example, creatorcomment, chat, talkativeness, fav, tags, create_date, legacy_fields=True):
+    data = {
         "name": name,
         "description": description,
         "personality": personality,
         "scenario": scenario,
         "first_mes": first_mes,
         "mes_example": mes_example,
-        "creatorcomment": creatorcomment,
-        "avatar": "none",
-        "chat": chat,
-        "talkativeness": talkativeness,
-        "fav": fav,
+        "creator_notes": creatorcomment,
+        "system_prompt": "",
+        "post_history_instructions": "",
         "tags": tags,
+        "creator": "",
+        "character_version": "",
+        "alternate_greetings": [],
+        "extensions": {
+            "talkativeness": talkativeness,
+            "fav": fav,
+            "world": "",
+            "depth_prompt": {
+                "prompt": "",
+                "depth": 1,
+                "role": "system"
+            }
+        }
+    }
+    card = {
         "spec": "chara_card_v2",
         "spec_version": "2.0",
-        "data": {
-            "name": name,
-            "description": description,
-            "personality": personality,
-            "scenario": scenario,
-            "first_mes": first_mes,
-            "mes_example": mes_example,
-            "creator_notes": creatorcomment,
-            "system_prompt": "",
-            "post_history_instructions": "",
-            "tags": tags,
-            "creator": "",
-            "character_version": "",
-            "alternate_greetings": [],
-            "extensions": {
-                "talkativeness": talkativeness,
-                "fav": fav,
-                "world": "",
-                "depth_prompt": {
-                    "prompt": "",
-                    "depth": 1,
-                    "role": "system"
-                }
-            }
-        },
+        "data": data,
+        "avatar": "none",
+        "chat": chat,
         "create_date": create_date
     }
-
-def main():
+    if legacy_fields:
+        card.update({key: data[key] for key in _FLAT_KEYS})
+        card.update(creatorcomment=creatorcomment, talkativeness=talkativeness, fav=fav)
+    return card
+
+def dump_card(card: dict) -> bytes:
+    """Serialize a character card to indented UTF-8 JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(card, option=orjson.OPT_INDENT_2)
+    return json.dumps(card, indent=2, ensure_ascii=False).encode()
+
+async def main():
     print("""
     Welcome to the TavernAI character card creator. 
     Please provide a free-form description of the character you want to create.
@@ -122,98 +155,95 @@ def main():
     set_llm_env(api_key)
     print("Environment variables set successfully.")
 
-    user_input = input("Enter your character description: ").strip()
-
-    # Set default values
-    chat = f"Character - {datetime.datetime.now().strftime('%Y-%m-%d @%Hh %Mm %Ss %fms')}"
-    talkativeness = 0.5
-    fav = False
-    tags = []
-    create_date = datetime.datetime.now().strftime('%Y-%m-%d @%Hh %Mm %Ss %fms')
-
-    # Define agents
-    card_creator_agent = create_agent("Card Creator", "Create a detailed and engaging character card based on the user's free-form input.", "google/gemma-2-9b-it:free")
-    personality_critic_agent = create_agent("Personality Critic", "Ensure the character has a well-rounded and interesting personality.", "meta-llama/llama-3-8b-instruct:free")
-    scenario_critic_agent = create_agent("Scenario Critic", "Ensure the character's scenario is engaging, interesting, and consistent with their personality.", "meta-llama/llama-3-8b-instruct:free")
-    message_critic_agent = create_agent("Message Critic", "Ensure the opening message is engaging and properly formatted.", "meta-llama/llama-3-8b-instruct:free")
-
-    # Define tasks
-    tasks = [
-        Task(
-            description=f"Create a character card based on the following user input: {user_input}. Include name, description, personality, scenario, first message, example message, and creator comment. Use {{{{char}}}} to refer to the character being created and {{{{user}}}} for the user interacting with the character.",
-            agent=card_creator_agent,
-            expected_output="A JSON string containing the character card details."
-        ),
-        Task(
-            description="Review and enhance the personality of the character. Ensure {{char}} is used consistently to refer to the character.",
-            agent=personality_critic_agent,
-            expected_output="A string containing feedback and suggestions for the character's personality."
-        ),
-        Task(
-            description="Review and improve the scenario for the character. Verify that {{char}} and {{user}} are used appropriately in the scenario.",
-            agent=scenario_critic_agent,
-            expected_output="A string containing feedback and suggestions for the character's scenario."
-        ),
-        Task(
-            description="Review and refine the first message and example message for the character. Ensure proper formatting with *italics* for narration and \"quotes\" for dialogue. Confirm that {{char}} and {{user}} are used correctly in the messages.",
-            agent=message_critic_agent,
-            expected_output="A string containing feedback and suggestions for the character's messages."
-        )
-    ]
-
-        # Set up the crew
-    crew = Crew(
-        agents=[card_creator_agent, personality_critic_agent, scenario_critic_agent, message_critic_agent],
-        tasks=tasks,
-        verbose=True
-    )
+    # Warm up the connection while the user is typing the description
+    prewarm = asyncio.create_task(prewarm_connection())
 
     try:
-        # Kick off the process
-        result = crew.kickoff()
-        print("Process completed.")
-        
-        # Extract the final character card from the result
-        if isinstance(result, list) and len(result) > 0:
-            character_card_json = get_task_result(result[0])
-        else:
-            character_card_json = get_task_result(result)
-        
-        # Parse the JSON string into a Python dictionary
+        user_input = (await read_input("Enter your character description: ")).strip()
+        if not is_meaningful_input(user_input):
+            print(f"Description too short: please describe the character in words, at least {MIN_INPUT_LENGTH} characters long.")
+            return
+
+        # Set default values
+        create_date = datetime.datetime.now().strftime(_TIMESTAMP_FORMAT)
+        chat = f"Character - {create_date}"
+
+        # Define agents
+        card_creator_agent = create_agent("Card Creator", "Create a detailed and engaging character card based on the user's free-form input.", "google/gemma-2-9b-it:free", CARD_MAX_TOKENS, json_mode=True)
+        personality_critic_agent = create_agent("Personality Critic", "Ensure the character has a well-rounded and interesting personality.", "meta-llama/llama-3-8b-instruct:free", CRITIC_MAX_TOKENS)
+        scenario_critic_agent = create_agent("Scenario Critic", "Ensure the character's scenario is engaging, interesting, and consistent with their personality.", "meta-llama/llama-3-8b-instruct:free", CRITIC_MAX_TOKENS)
+        message_critic_agent = create_agent("Message Critic", "Ensure the opening message is engaging and properly formatted.", "meta-llama/llama-3-8b-instruct:free", CRITIC_MAX_TOKENS)
+
+        # Define tasks
+        tasks = [
+            Task(
+                description=f"Create a character card based on the following user input: {user_input}. Respond with a JSON object with the keys name, description, personality, scenario, first_message, example_message, creator_comment and tags (a list of strings). Use {{{{char}}}} to refer to the character being created and {{{{user}}}} for the user interacting with the character.",
+                agent=card_creator_agent,
+                expected_output="A JSON object containing the character card details."
+            ),
+            Task(
+                description="Review and enhance the personality of the character. Ensure {{char}} is used consistently to refer to the character.",
+                agent=personality_critic_agent,
+                expected_output="A string containing feedback and suggestions for the character's personality."
+            ),
+            Task(
+                description="Review and improve the scenario for the character. Verify that {{char}} and {{user}} are used appropriately in the scenario.",
+                agent=scenario_critic_agent,
+                expected_output="A string containing feedback and suggestions for the character's scenario."
+            ),
+            Task(
+                description="Review and refine the first message and example message for the character. Ensure proper formatting with *italics* for narration and \"quotes\" for dialogue. Confirm that {{char}} and {{user}} are used correctly in the messages.",
+                agent=message_critic_agent,
+                expected_output="A string containing feedback and suggestions for the character's messages."
+            )
+        ]
+
+        # Run the tasks; the card is validated before the critics start
         try:
-            character_card = json.loads(character_card_json)
-        except json.JSONDecodeError:
-            print("Error: Unable to parse the character card JSON. Using raw output.")
-            character_card = {"name": "Unnamed Character", "description": character_card_json}
+            result = await run_pipeline(tasks)
+        except ValidationError as e:
+            print(f"\n\nError: The card creator did not return a valid character card, nothing was saved.\n{e}")
+            return
+        print("\n\nProcess completed.")
+
+        # The validated character card from the card creator
+        character_card = result[0]
 
         # Create the final character card
         final_card = create_character_card(
-            name=character_card.get('name', 'Unnamed Character'),
-            description=character_card.get('description', ''),
-            personality=character_card.get('personality', ''),
-            scenario=character_card.get('scenario', ''),
-            first_mes=character_card.get('first_message', ''),
-            mes_example=character_card.get('example_message', ''),
-            creatorcomment=character_card.get('creator_comment', ''),
+            name=character_card.name,
+            description=character_card.description,
+            personality=character_card.personality,
+            scenario=character_card.scenario,
+            first_mes=character_card.first_message,
+            mes_example=character_card.example_message,
+            creatorcomment=character_card.creator_comment,
             chat=chat,
-            talkativeness=character_card.get('talkativeness', talkativeness),
-            fav=character_card.get('fav', fav),
-            tags=character_card.get('tags', tags),
-            create_date=create_date
+            talkativeness=character_card.talkativeness,
+            fav=character_card.fav,
+            tags=character_card.tags,
+            create_date=create_date,
+            legacy_fields=CARD_LEGACY_FIELDS
         )
 
         # Print the final character card
-        print("\nFinal Character Card:")
-        print(json.dumps(final_card, indent=2))
+        payload = dump_card(final_card)
+        print("\nFinal Character Card:", flush=True)
+        sys.stdout.buffer.write(payload + b"\n")
+        sys.stdout.flush()
 
         # Save the character card to a file
-        file_name = f"{final_card['name'].lower().replace(' ', '_')}_character_card.json"
-        with open(file_name, 'w') as f:
-            json.dump(final_card, f, indent=2)
+        file_name = f"{character_card.name.lower().replace(' ', '_')}_character_card.json"
+        with open(file_name, 'wb') as f:
+            f.write(payload)
         print(f"\nCharacter card saved to {file_name}")
 
     except Exception as e:
         print(f"An error occurred: {str(e)}")
+    finally:
+        # The warm-up is never awaited, so a slow HEAD cannot delay the first LLM call
+        prewarm.cancel()
+        await close_http_client()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file